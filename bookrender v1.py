@@ -1,12 +1,167 @@
+import asyncio
+import multiprocessing
 import os
 import re
 import sys
 import shutil
+import queue
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 import fitz  # PyMuPDF
 
+_SANITIZE_RE = re.compile(r'[\\/*?:"<>|]')  # Characters not allowed in filenames
+
+# Whitespace in cp1252 bytes. Every run containing a line break collapses to a
+# single CR+LF, which strips each line and drops blank lines in one pass
+_LINE_BREAK_RE = re.compile(rb'[\s\x1c-\x1f\xa0]*[\n\r\v\f\x1c-\x1e][\s\x1c-\x1f\xa0]*')
+_EDGE_SPACE_RE = re.compile(rb'\A[\s\x1c-\x1f\xa0]+|[\s\x1c-\x1f\xa0]+\Z')
+
+class _FileWriter:
+    """Writes queued (path, bytes) files on a background thread so rendering never waits on disk"""
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)  # Bounded: rendering stalls before memory does
+        self._errors = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            path, data = self._queue.get()
+            try:
+                with open(path, "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def write(self, path, data):
+        self._queue.put((path, data))
+
+    def flush(self):
+        """Block until every queued file is written; re-raise the first failure"""
+        self._queue.join()
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+# Per-process state for the page workers: fitz documents can't be pickled,
+# so each worker opens its own handle on a book once and keeps it for its pages
+_worker = {}
+
+def _init_page_worker(processor):
+    _worker["processor"] = processor
+    _worker["docs"] = {}
+    _worker["writer"] = _FileWriter()
+
+def _worker_doc(pdf_path):
+    """This worker's handle on pdf_path, opened the first time one of its pages arrives"""
+    docs = _worker["docs"]
+    doc = docs.get(pdf_path)
+    if doc is None:
+        # Books share the pool, so only keep open as many as can render at once
+        while len(docs) >= _worker["processor"].max_concurrent_pdfs:
+            docs.pop(next(iter(docs))).close()
+        doc = docs[pdf_path] = fitz.open(pdf_path)
+    return doc
+
+def _render_batch_worker(pdf_path, batch):
+    """Render a batch of pages; returns how many failed"""
+    doc = _worker_doc(pdf_path)
+    failed = 0
+    try:
+        for page_num, output_dir in batch:
+            try:
+                _worker["processor"]._process_page(doc[page_num], page_num, output_dir)
+            except Exception as e:
+                print(f"Error processing page {page_num}: {str(e)}")
+                failed += 1
+    finally:
+        _worker["writer"].flush()  # Queued files are on disk before the batch returns
+    return failed
+
+# Start render workers from a clean server process (spawn where there is none)
+# instead of forking: the parent runs threads by then, and forking a threaded
+# process is unsafe with PyMuPDF
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Deletes superseded output folders while the next book is rendering
+_cleanup_pool = ThreadPoolExecutor(max_workers=1)
+
+# Staging and trash folders are hidden and tagged with the pid of the run that
+# made them, so a later run can tell its own (or another live run's) from leftovers
+_LEFTOVER_RE = re.compile(r'\..+\.(?:staging|trash)-(\d+)-[0-9a-f]{8}')
+_owned_dirs = set()
+
+def _owned_dir(parent, name, kind):
+    """Create parent/.name.kind-pid-random with the usual permissions, tagged as this run's"""
+    path = os.path.join(parent, f".{name}.{kind}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.mkdir(path)  # Unlike mkdtemp's 0700, honours the umask
+    _owned_dirs.add(path)
+    return path
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process here, so ask for its exit code
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # Access denied: it exists
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _sweep_leftovers(parent):
+    """Delete staging and trash folders whose run has died"""
+    for entry in os.listdir(parent):
+        match = _LEFTOVER_RE.fullmatch(entry)
+        if not match:
+            continue
+        path = os.path.join(parent, entry)
+        pid = int(match.group(1))
+        # Our own pid on a folder we didn't make is an earlier run that had it
+        if path not in _owned_dirs and (pid == os.getpid() or not _pid_alive(pid)):
+            shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def _staged_output(output_dir):
+    """Yield a sibling staging folder to write into, then swap it in for output_dir.
+
+    The previous output survives a failed run, and is deleted in the background
+    instead of file-by-file before rendering starts."""
+    parent, name = os.path.split(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    _sweep_leftovers(parent)
+    staging_dir = _owned_dir(parent, name, "staging")
+    try:
+        yield staging_dir
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    if os.path.exists(output_dir):
+        trash_dir = _owned_dir(parent, name, "trash")
+        os.rename(output_dir, os.path.join(trash_dir, "old"))
+        _cleanup_pool.submit(shutil.rmtree, trash_dir, True)
+    os.rename(staging_dir, output_dir)
+
 class PDFBookProcessor:
     def __init__(self):
         self.include_images = True
+        self.page_batch_size = 16  # Pages handed to a worker process at a time
+        self.max_concurrent_pdfs = 2  # PDFs rendered at the same time
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
 
     def main_menu(self):
@@ -34,26 +189,41 @@ class PDFBookProcessor:
         if not os.path.exists("processed_books"):
             os.makedirs("processed_books")
 
-        processed_count = 0
-        for filename in os.listdir(self.script_dir):
-            full_path = os.path.join(self.script_dir, filename)
-            
-            if (os.path.isdir(full_path) or filename.startswith('~$') or not filename.lower().endswith('.pdf')):
-                continue
-                
-            try:
-                print(f"Processing {filename}...", end='', flush=True)
-                self.process_pdf_file(full_path)
-                processed_count += 1
-                print("✓")
-            except Exception as e:
-                print(f"✗ Failed: {self.format_error(e)}")
+        # One directory read; DirEntry.is_file() uses the cached entry type, no stat per file
+        with os.scandir(self.script_dir) as entries:
+            pdf_paths = [entry.path for entry in entries
+                         if entry.name.lower().endswith('.pdf') and not entry.name.startswith('~$')
+                         and entry.is_file()]
+
+        with self._page_pool() as pool:
+            processed_count = sum(asyncio.run(self._process_pdfs_concurrently(pool, pdf_paths)))
 
         if processed_count == 0:
             print("\nNo PDFs found in the current directory.")
         else:
             print(f"\nProcessed {processed_count} PDF(s).")
 
+    async def _process_pdfs_concurrently(self, pool, pdf_paths):
+        """Process several PDFs at once on one pool, so a book's tail overlaps the next one's start."""
+        limit = asyncio.Semaphore(self.max_concurrent_pdfs)
+        # Books whose names sanitise to the same folder take turns at it
+        folder_locks = {}
+
+        async def process(full_path):
+            filename = os.path.basename(full_path)
+            folder_lock = folder_locks.setdefault(os.path.normcase(self._book_dir(full_path)), asyncio.Lock())
+            async with folder_lock, limit:
+                try:
+                    print(f"Processing {filename}...")
+                    await asyncio.to_thread(self.process_pdf_file, full_path, pool)
+                    print(f"✓ {filename}")
+                    return True
+                except Exception as e:
+                    print(f"✗ {filename} failed: {self.format_error(e)}")
+                    return False
+
+        return await asyncio.gather(*(process(path) for path in pdf_paths))
+
     def format_error(self, error):
         """Convert errors to user-friendly messages."""
         error_str = str(error)
@@ -63,7 +233,12 @@ class PDFBookProcessor:
             return "Password-protected PDF"
         return error_str
 
-    def process_pdf_file(self, filepath):
+    def _book_dir(self, filepath):
+        """Output folder for a PDF, named after its file"""
+        book_title = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(self.script_dir, "processed_books", self.sanitize_filename(book_title))
+
+    def process_pdf_file(self, filepath, pool):
         """Process a single PDF file with Nokia-compatible output."""
         doc = None
         try:
@@ -71,16 +246,12 @@ class PDFBookProcessor:
             if not doc.is_pdf:
                 raise ValueError("Not a valid PDF file")
                 
-            book_title = os.path.splitext(os.path.basename(filepath))[0]
-            output_dir = os.path.join(self.script_dir, "processed_books", self.sanitize_filename(book_title))
-            
-            if os.path.exists(output_dir):
-                shutil.rmtree(output_dir)
-            os.makedirs(output_dir)
+            output_dir = self._book_dir(filepath)
 
-            toc = doc.get_toc()
-            chapter_ranges = self._get_chapter_ranges(doc, toc)
-            self._process_all_pages(doc, chapter_ranges, output_dir)
+            with _staged_output(output_dir) as staging_dir:
+                toc = doc.get_toc()
+                chapter_ranges = self._get_chapter_ranges(doc, toc)
+                self._process_all_pages(doc, chapter_ranges, staging_dir, pool)
             
         finally:
             if doc:
@@ -88,7 +259,7 @@ class PDFBookProcessor:
 
     def _get_chapter_ranges(self, doc, toc):
         """Identify chapter ranges and front/back matter."""
-        chapters = {}
+        chapters = []  # (chapter_num, name, start_page), appended in chapter order
         first_chapter_start = len(doc)  # Initialize with max value
         last_chapter_end = 0
         
@@ -98,7 +269,7 @@ class PDFBookProcessor:
             if len(entry) >= 3 and entry[0] == 1:  # Level 1 entries only
                 page_num = max(0, entry[2] - 1)  # Convert to 0-based
                 chapter_name = f"{chapter_num:02d}_{self.sanitize_title(entry[1])}"
-                chapters[chapter_name] = page_num
+                chapters.append((chapter_num, chapter_name, page_num))
                 first_chapter_start = min(first_chapter_start, page_num)
                 last_chapter_end = max(last_chapter_end, page_num)
                 chapter_num += 1
@@ -109,10 +280,9 @@ class PDFBookProcessor:
             # Front matter (everything before first chapter)
             ranges["0000_cover"] = (0, first_chapter_start - 1)
             
-            # Chapters (sorted by their number)
-            sorted_chapters = sorted(chapters.items(), key=lambda x: int(x[0][:2]))
-            for i, (name, start) in enumerate(sorted_chapters):
-                end = (sorted_chapters[i+1][1] - 1) if i+1 < len(sorted_chapters) else last_chapter_end
+            # Chapters (already in number order, so no sort is needed)
+            for i, (_, name, start) in enumerate(chapters):
+                end = (chapters[i+1][2] - 1) if i+1 < len(chapters) else last_chapter_end
                 ranges[name] = (start, min(end, len(doc) - 1))
             
             # Back matter (everything after last chapter)
@@ -123,8 +293,9 @@ class PDFBookProcessor:
             
         return ranges
 
-    def _process_all_pages(self, doc, ranges, output_dir):
+    def _process_all_pages(self, doc, ranges, output_dir, pool):
         """Process all pages according to the ranges."""
+        jobs = []
         for folder_name, (start, end) in ranges.items():
             if start > end:  # Skip invalid ranges
                 continue
@@ -133,8 +304,28 @@ class PDFBookProcessor:
             os.makedirs(folder_path, exist_ok=True)
             
             print(f"  Processing {folder_name} (pages {start+1}-{end+1})")
-            for page_num in range(start, end + 1):
-                self._process_page(doc.load_page(page_num), page_num, folder_path)
+            jobs.extend((page_num, folder_path) for page_num in range(start, end + 1))
+
+        self._process_pages(pool, doc.name, jobs)
+
+    def _page_pool(self):
+        """One render process per CPU core, shared by every book in a run"""
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_POOL_CONTEXT,
+                                   initializer=_init_page_worker, initargs=(self,))
+
+    def _process_pages(self, pool, pdf_path, jobs):
+        """Render (page_num, output_dir) jobs in parallel on the shared pool"""
+        # Hand each worker a run of consecutive pages, but keep batches small
+        # enough that short jobs still spread over every core
+        workers = os.cpu_count() or 1
+        size = max(1, min(self.page_batch_size, -(-len(jobs) // workers)))
+        futures = [pool.submit(_render_batch_worker, pdf_path, jobs[i:i + size])
+                   for i in range(0, len(jobs), size)]
+        wait(futures)  # Every batch settles before a failure can unwind the book
+        # A book with failed pages must not replace the last good output
+        failed = sum(future.result() for future in futures)
+        if failed:
+            raise RuntimeError(f"{failed} of {len(jobs)} pages failed")
 
     def _process_page(self, page, page_num, folder_path):
         # Nokia-compatible filename (8.3 format, uppercase)
@@ -145,30 +336,26 @@ class PDFBookProcessor:
         text = page.get_text("text")
         
         # Step 1: Force ANSI encoding (drop unsupported chars)
-        text = text.encode('cp1252', errors='ignore').decode('cp1252')
-        
-        # Step 2: Normalize line endings to Windows CR+LF
-        text = text.replace('\r\n', '\n').replace('\n', '\r\n')
+        text = text.encode('cp1252', errors='ignore')
         
-        # Step 3: Remove trailing spaces/blank lines
-        text = '\r\n'.join(line.strip() for line in text.splitlines() if line.strip())
+        # Step 2: Strip spaces/blank lines and normalize line endings to CR+LF
+        text = _LINE_BREAK_RE.sub(b'\r\n', _EDGE_SPACE_RE.sub(b'', text))
         
-        # Write the file
-        with open(text_path, 'w', encoding='cp1252') as f:
-            f.write(text)
+        # Queue the bytes as-is (no text-mode newline translation)
+        _worker["writer"].write(text_path, text)
 
         # Images (unchanged)
         if self.include_images and page.get_images():
             pix = page.get_pixmap()
-            pix.save(os.path.join(folder_path, f"{file_prefix}.PNG"))
+            _worker["writer"].write(os.path.join(folder_path, f"{file_prefix}.PNG"), pix.tobytes("png"))
 
     def sanitize_filename(self, name):
         """Make safe filenames."""
-        return re.sub(r'[\\/*?:"<>|]', "_", name).strip()
+        return _SANITIZE_RE.sub("_", name).strip()
 
     def sanitize_title(self, title):
         """Clean and shorten titles."""
-        clean = re.sub(r'[\\/*?:"<>|]', "", title)
+        clean = _SANITIZE_RE.sub("", title)
         return clean[:30].replace(" ", "_")  # Shorter for Nokia compatibility
 
 if __name__ == "__main__":
@@ -1,14 +1,248 @@
+import asyncio
+import io
+import multiprocessing
 import os
 import re
 import sys
 import shutil
+import queue
+import struct
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 import numpy as np
 import fitz  # PyMuPDF
 from PIL import Image, ImageFilter, ImageOps
 
+_SANITIZE_RE = re.compile(r'[\\/*?:"<>|]')  # Characters not allowed in filenames
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; PIL's dither is used without it
+    njit = None
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False)
+    def _fs_dither_1bit(gray, white):
+        """Floyd-Steinberg dither (same integer maths as PIL) into a bool mask"""
+        h, w = gray.shape
+        errors = np.zeros(w + 1, np.int32)  # Next row's error, 16x fixed point
+        for y in range(h):
+            l = l0 = l1 = 0
+            for x in range(w):
+                e = l + errors[x + 1]
+                e = e // 16 if e >= 0 else -(-e // 16)  # C-style truncation
+                l = min(max(gray[y, x] + e, 0), 255)
+                if l > 128:
+                    white[y, x] = True
+                    l -= 255
+                # Spread 7/16 right, 3/16, 5/16, 1/16 onto the next row
+                l2 = l
+                d2 = l + l
+                l += d2
+                errors[x] = l + l0
+                l += d2
+                l0 = l + l1
+                l1 = l2
+                l += d2
+            errors[w] = l0
+
+def _dither_1bit(gray):
+    """Dither a grayscale array to a bool mask (True = white), via numba when available"""
+    if njit is None:
+        return np.asarray(Image.fromarray(gray).convert("1", dither=Image.FLOYDSTEINBERG))
+    white = _scratch("dither", gray.shape, np.bool_)  # Consumed before the next call
+    white.fill(False)
+    _fs_dither_1bit(gray, white)
+    return white
+
+_BMP1_HEADERS = {}  # (width, height) -> file header, info header and palette
+
+def _bmp1_parts(bits):
+    """Encode a 2-D bool array (True = white) as an uncompressed 1-bit BMP: (header, pixel rows)"""
+    h, w = bits.shape
+    stride = ((w + 31) // 32) * 4  # BMP rows are padded to 4 bytes
+    rows = np.zeros((h, stride), np.uint8)
+    rows[::-1, :(w + 7) // 8] = np.packbits(bits, axis=1)  # Rows are stored bottom-up
+    header = _BMP1_HEADERS.get((w, h))
+    if header is None:
+        image = stride * h
+        header = _BMP1_HEADERS[(w, h)] = struct.pack(
+            "<2sIIIIiiHHIIiiII8s", b"BM", 62 + image, 0, 62,
+            40, w, h, 1, 1, 0, image, 3780, 3780, 2, 2,  # 3780 px/m = 96 DPI
+            b"\x00\x00\x00\x00\xff\xff\xff\x00")  # Palette: index 0 black, 1 white
+    return header, rows
+
+# O_BINARY keeps Windows from translating newline bytes in the pixel data
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+class _FileWriter:
+    """Writes queued files, given as byte chunks, on a background thread so rendering never waits on disk"""
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)  # Bounded: rendering stalls before memory does
+        self._errors = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            path, chunks = self._queue.get()
+            try:
+                fd = os.open(path, _WRITE_FLAGS, 0o644)
+                try:
+                    for chunk in chunks:
+                        view = memoryview(chunk).cast("B")
+                        while view:  # os.write may write less than asked
+                            view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def write(self, path, *chunks):
+        self._queue.put((path, chunks))
+
+    def flush(self):
+        """Block until every queued file is written; re-raise the first failure"""
+        self._queue.join()
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+# Per-process state for the page workers: fitz documents can't be pickled,
+# so each worker opens its own handle on a book once and keeps it for its pages
+_worker = {}
+
+def _scratch(name, shape, dtype):
+    """Per-process buffer reused across pages; only valid until the next call for name"""
+    size = int(np.prod(shape))
+    buf = _worker.get(name)
+    if buf is None or buf.size < size or buf.dtype != dtype:
+        buf = _worker[name] = np.empty(max(size, 1), dtype)
+    return buf[:size].reshape(shape)
+
+def _is_blank_page(page, images):
+    """No images, text or vector drawings; the costly drawings list is only built for pages passing the rest"""
+    return not images and not page.get_text("text").strip() and not page.get_drawings()
+
+def _init_page_worker(processor):
+    _worker["processor"] = processor
+    _worker["docs"] = {}
+    _worker["writer"] = _FileWriter()
+
+def _worker_doc(pdf_path):
+    """This worker's handle on pdf_path, opened the first time one of its pages arrives"""
+    docs = _worker["docs"]
+    doc = docs.get(pdf_path)
+    if doc is None:
+        # Books share the pool, so only keep open as many as can render at once
+        while len(docs) >= _worker["processor"].max_concurrent_pdfs:
+            docs.pop(next(iter(docs))).close()
+        doc = docs[pdf_path] = fitz.open(pdf_path)
+    return doc
+
+def _render_batch_worker(pdf_path, batch):
+    """Render a batch of pages; returns how many failed"""
+    doc = _worker_doc(pdf_path)
+    failed = 0
+    for page_num, output_dir in batch:
+        try:
+            _worker["processor"]._process_page(doc[page_num], page_num, output_dir)
+        except Exception as e:
+            print(f"Error processing page {page_num}: {str(e)}")
+            failed += 1
+    try:
+        _worker["writer"].flush()
+    except OSError as e:
+        print(f"Write error: {str(e)}")
+        return len(batch)  # No telling which of the batch's files made it
+    return failed
+
+# Start render workers from a clean server process (spawn where there is none)
+# instead of forking: the parent runs threads by then, and forking a threaded
+# process is unsafe with PyMuPDF
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Deletes superseded output folders while the next book is rendering
+_cleanup_pool = ThreadPoolExecutor(max_workers=1)
+
+# Staging and trash folders are hidden and tagged with the pid of the run that
+# made them, so a later run can tell its own (or another live run's) from leftovers
+_LEFTOVER_RE = re.compile(r'\..+\.(?:staging|trash)-(\d+)-[0-9a-f]{8}')
+_owned_dirs = set()
+
+def _owned_dir(parent, name, kind):
+    """Create parent/.name.kind-pid-random with the usual permissions, tagged as this run's"""
+    path = os.path.join(parent, f".{name}.{kind}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.mkdir(path)  # Unlike mkdtemp's 0700, honours the umask
+    _owned_dirs.add(path)
+    return path
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process here, so ask for its exit code
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # Access denied: it exists
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _sweep_leftovers(parent):
+    """Delete staging and trash folders whose run has died"""
+    for entry in os.listdir(parent):
+        match = _LEFTOVER_RE.fullmatch(entry)
+        if not match:
+            continue
+        path = os.path.join(parent, entry)
+        pid = int(match.group(1))
+        # Our own pid on a folder we didn't make is an earlier run that had it
+        if path not in _owned_dirs and (pid == os.getpid() or not _pid_alive(pid)):
+            shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def _staged_output(output_dir):
+    """Yield a sibling staging folder to write into, then swap it in for output_dir.
+
+    The previous output survives a failed run, and is deleted in the background
+    instead of file-by-file before rendering starts."""
+    parent, name = os.path.split(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    _sweep_leftovers(parent)
+    staging_dir = _owned_dir(parent, name, "staging")
+    try:
+        yield staging_dir
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    if os.path.exists(output_dir):
+        trash_dir = _owned_dir(parent, name, "trash")
+        os.rename(output_dir, os.path.join(trash_dir, "old"))
+        _cleanup_pool.submit(shutil.rmtree, trash_dir, True)
+    os.rename(staging_dir, output_dir)
+
 class PDFProcessor:
     def __init__(self):
         self.test_mode = False
+        self.page_batch_size = 16  # Pages handed to a worker process at a time
+        self.max_concurrent_pdfs = 2  # PDFs rendered at the same time
+        self.screen_long_edge = 320  # Nokia 5310 display is 240x320
+        self.render_overscan = 1.25  # Headroom so the cropped page still fills the screen
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
 
     def show_menu(self):
@@ -40,102 +274,154 @@ class PDFProcessor:
         if not os.path.exists("processed_books"):
             os.makedirs("processed_books")
 
-        pdf_files = [f for f in os.listdir(self.script_dir) 
-                   if f.lower().endswith('.pdf') and not f.startswith('~$')]
+        with os.scandir(self.script_dir) as entries:
+            pdf_files = [e.name for e in entries
+                         if e.name.lower().endswith('.pdf') and not e.name.startswith('~$') and e.is_file()]
 
         if not pdf_files:
             print("\nNo PDF files found in current directory!")
             return
 
-        for pdf in pdf_files:
-            print(f"\nProcessing: {pdf}")
-            try:
-                self._process_pdf(pdf)
-                print("✓ Success")
-            except Exception as e:
-                print(f"✗ Failed: {str(e)}")
+        with self._page_pool() as pool:
+            asyncio.run(self._process_pdfs_concurrently(pool, pdf_files))
 
-    def _process_pdf(self, filename):
-        doc = fitz.open(os.path.join(self.script_dir, filename))
+    async def _process_pdfs_concurrently(self, pool, pdf_files):
+        """Process several PDFs at once on one pool, so a book's tail overlaps the next one's start"""
+        limit = asyncio.Semaphore(self.max_concurrent_pdfs)
+        # Books whose names sanitise to the same folder take turns at it
+        folder_locks = {}
+
+        async def process(pdf):
+            folder_lock = folder_locks.setdefault(os.path.normcase(self._book_dir(pdf)), asyncio.Lock())
+            async with folder_lock, limit:
+                print(f"\nProcessing: {pdf}")
+                try:
+                    await asyncio.to_thread(self._process_pdf, pdf, pool)
+                    print(f"✓ Success: {pdf}")
+                except Exception as e:
+                    print(f"✗ Failed: {pdf}: {str(e)}")
+
+        await asyncio.gather(*(process(pdf) for pdf in pdf_files))
+
+    def _book_dir(self, filename):
+        """Output folder for a PDF, named after its file"""
         book_title = os.path.splitext(filename)[0]
-        output_dir = os.path.join(self.script_dir, "processed_books", self._sanitize(book_title))
+        return os.path.join(self.script_dir, "processed_books", self._sanitize(book_title))
 
-        if os.path.exists(output_dir):
-            shutil.rmtree(output_dir)
-        os.makedirs(output_dir)
+    def _process_pdf(self, filename, pool):
+        doc = fitz.open(os.path.join(self.script_dir, filename))
+        output_dir = self._book_dir(filename)
 
-        max_pages = 10 if self.test_mode else len(doc)
-        for page_num in range(min(len(doc), max_pages)):
-            try:
-                page = doc.load_page(page_num)
-                self._process_page(page, page_num, output_dir)
-            except Exception as e:
-                print(f"Error processing page {page_num}: {str(e)}")
+        with _staged_output(output_dir) as staging_dir:
+            max_pages = 10 if self.test_mode else len(doc)
+            jobs = [(page_num, staging_dir) for page_num in range(min(len(doc), max_pages))]
+            self._process_pages(pool, doc.name, jobs)
 
         doc.close()
 
+    def _page_pool(self):
+        """One render process per CPU core, shared by every book in a run"""
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_POOL_CONTEXT,
+                                   initializer=_init_page_worker, initargs=(self,))
+
+    def _process_pages(self, pool, pdf_path, jobs):
+        """Render (page_num, output_dir) jobs in parallel on the shared pool"""
+        # Hand each worker a run of consecutive pages, but keep batches small
+        # enough that short jobs still spread over every core
+        workers = os.cpu_count() or 1
+        size = max(1, min(self.page_batch_size, -(-len(jobs) // workers)))
+        futures = [pool.submit(_render_batch_worker, pdf_path, jobs[i:i + size])
+                   for i in range(0, len(jobs), size)]
+        wait(futures)  # Every batch settles before a failure can unwind the book
+        # A book with failed pages must not replace the last good output
+        failed = sum(future.result() for future in futures)
+        if failed:
+            raise RuntimeError(f"{failed} of {len(jobs)} pages failed")
+
     def _process_page(self, page, page_num, output_dir):
-        # Render at Nokia-friendly resolution
-        pix = page.get_pixmap(dpi=144)  # 144 DPI = 6px/mm (Nokia native)
+        # Blank pages (chapter-end fillers) have no text, images or vector
+        # drawings; checking that is far cheaper than rasterising them
+        images = page.get_images()
+        if _is_blank_page(page, images):
+            return
+
+        # Render straight at Nokia resolution: the page width becomes the
+        # screen's long edge once the halves are rotated
+        # Pages in a book nearly all share one width, so build its Matrix once
+        matrices = _worker.setdefault("matrices", {})
+        matrix = matrices.get(page.rect.width)
+        if matrix is None:
+            zoom = self.screen_long_edge * self.render_overscan / page.rect.width
+            matrix = matrices[page.rect.width] = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+        # Pixel sizes below were tuned on 144 DPI renders (2 px per point);
+        # scale them so they cover the same area of the page at this zoom
+        scale = matrix.a / 2
         
-        # Convert to Nokia-compatible format
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        # pix.samples is already a bytes copy of the pixmap; wrap that copy rather than making another
+        img = Image.frombuffer("L", (pix.width, pix.height), pix.samples, "raw", "L", 0, 1)
         
         # Full-page image detection
-        if len(page.get_images()) > 3:
-            img = img.convert("L")  # Grayscale
+        if len(images) > 3:
             img = ImageOps.autocontrast(img, cutoff=5)
-            img.save(os.path.join(output_dir, f"{page_num + 1:04d}c.bmp"), format="BMP")
+            bmp = io.BytesIO()
+            img.save(bmp, format="BMP")
+            _worker["writer"].write(os.path.join(output_dir, f"{page_num + 1:04d}c.bmp"), bmp.getvalue())
             return
 
-        # Convert to grayscale for processing
-        gray = img.convert("L")
-        gray = ImageOps.autocontrast(gray, cutoff=5)
+        gray = ImageOps.autocontrast(img, cutoff=5)
         
         # Crop whitespace
-        cropped = self._crop_whitespace(gray)
+        cropped = self._crop_whitespace(gray, scale)
         if cropped:
-            width, height = cropped.size
+            arr = np.asarray(cropped)
+            height = arr.shape[0]
             #   temporarily changed for testing        overlap = int(height * 0.10)  # 10% overlap
-            overlap = max(int(height * 0.03), 10)
+            overlap = max(int(height * 0.03), round(10 * scale))
             
-            # Split with overlap
-            top = cropped.crop((0, 0, width, height//2 + overlap))
-            bottom = cropped.crop((0, height//2 - overlap, width, height))
+            # Split with overlap: views into one array instead of two PIL crops
+            top = arr[:height//2 + overlap]
+            bottom = arr[max(height//2 - overlap, 0):]
             
             # Apply Nokia-specific optimizations
             for half, suffix in [(top, "a"), (bottom, "b")]:
                 # Convert to 1-bit with dithering for best Nokia display
-                bw = half.convert("1", dither=Image.FLOYDSTEINBERG)
-                rotated = bw.transpose(Image.ROTATE_270)
+                bw = _dither_1bit(half)
+                rotated = np.rot90(bw, k=-1)  # Same as ROTATE_270, as a view
                 
-                # Save as uncompressed BMP
-                rotated.save(
-                    os.path.join(output_dir, f"{page_num + 1:04d}{suffix}.bmp"),
-                    format="BMP"
-                )
-
-    def _crop_whitespace(self, img):
-        """Advanced cropping ignoring decorative margins."""
-        arr = np.array(img)
-        margin = int(min(arr.shape) * 0.05)
+                # Save as uncompressed 1-bit BMP
+                _worker["writer"].write(os.path.join(output_dir, f"{page_num + 1:04d}{suffix}.bmp"),
+                                        *_bmp1_parts(rotated))
+
+    def _crop_whitespace(self, img, scale=1):
+        """Advanced cropping ignoring decorative margins; scale resizes the 144 DPI pixel slop."""
+        arr = np.asarray(img)
+        
+        # Edges only need to be found to within the slop below, so scan
+        # every other row/column: a strided view, a quarter of the pixels
+        step = 2
+        slop = max(round(5 * scale), step)  # 5px at 144 DPI, never finer than the scan
+        small = arr[::step, ::step]
+        margin = -(-int(min(arr.shape) * 0.05) // step)  # In downsampled pixels
         
         # Detect content area (more tolerant of light decorations)
-        content_mask = arr < 220  # 220 threshold catches near-white
+        content_mask = np.less(small, 220, out=_scratch("mask", small.shape, np.bool_))  # 220 catches near-white
         
-        vertical_proj = np.max(content_mask, axis=0)
-        horizontal_proj = np.max(content_mask, axis=1)
+        # any() is the native bool reduction, cheaper than max() over the mask
+        col_any = content_mask.any(axis=0, out=_scratch("col_any", small.shape[1], np.bool_))
+        row_any = content_mask.any(axis=1, out=_scratch("row_any", small.shape[0], np.bool_))
         
-        left = max(np.argmax(vertical_proj[margin:]) + margin - 5, 0)
-        right = min(len(vertical_proj) - np.argmax(vertical_proj[::-1][margin:]) - margin + 5, arr.shape[1])
-        top = max(np.argmax(horizontal_proj[margin:]) + margin - 5, 0)
-        bottom = min(len(horizontal_proj) - np.argmax(horizontal_proj[::-1][margin:]) - margin + 5, arr.shape[0])
+        # [::-1] is a strided view, so scanning from the far edge copies nothing
+        left = max((int(col_any[margin:].argmax()) + margin) * step - slop, 0)
+        right = min((len(col_any) - int(col_any[::-1][margin:].argmax()) - margin) * step + slop, arr.shape[1])
+        top = max((int(row_any[margin:].argmax()) + margin) * step - slop, 0)
+        bottom = min((len(row_any) - int(row_any[::-1][margin:].argmax()) - margin) * step + slop, arr.shape[0])
         
         return img.crop((left, top, right, bottom))
 
     def _sanitize(self, text):
         """Clean filenames for Nokia compatibility."""
-        return re.sub(r'[\\/*?:"<>|]', "", text)[:30].replace(" ", "_")
+        return _SANITIZE_RE.sub("", text)[:30].replace(" ", "_")
 
 if __name__ == "__main__":
     os.system('cls' if os.name == 'nt' else 'clear')
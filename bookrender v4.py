@@ -1,15 +1,207 @@
+import asyncio
+import multiprocessing
 import os
 import re
 import sys
 import shutil
+import queue
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
 import numpy as np
 import fitz  # PyMuPDF
 from PIL import Image, ImageOps
 
+_SANITIZE_RE = re.compile(r'[\\/*?:"<>|()…]')  # Characters that break Windows paths
+_DIGITS_RE = re.compile(r'\d+')
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; PIL's dither is used without it
+    njit = None
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False)
+    def _fs_dither_1bit(gray, white):
+        """Floyd-Steinberg dither (same integer maths as PIL) into a bool mask"""
+        h, w = gray.shape
+        errors = np.zeros(w + 1, np.int32)  # Next row's error, 16x fixed point
+        for y in range(h):
+            l = l0 = l1 = 0
+            for x in range(w):
+                e = l + errors[x + 1]
+                e = e // 16 if e >= 0 else -(-e // 16)  # C-style truncation
+                l = min(max(gray[y, x] + e, 0), 255)
+                if l > 128:
+                    white[y, x] = True
+                    l -= 255
+                # Spread 7/16 right, 3/16, 5/16, 1/16 onto the next row
+                l2 = l
+                d2 = l + l
+                l += d2
+                errors[x] = l + l0
+                l += d2
+                l0 = l + l1
+                l1 = l2
+                l += d2
+            errors[w] = l0
+
+def _dither_1bit(gray):
+    """Dither a grayscale array to a bool mask (True = white), via numba when available"""
+    if njit is None:
+        return np.asarray(Image.fromarray(gray).convert("1", dither=Image.FLOYDSTEINBERG))
+    white = _scratch("dither", gray.shape, np.bool_)  # Consumed before the next call
+    white.fill(False)
+    _fs_dither_1bit(gray, white)
+    return white
+
+_BMP1_HEADERS = {}  # (width, height) -> file header, info header and palette
+
+def _bmp1_parts(bits):
+    """Encode a 2-D bool array (True = white) as an uncompressed 1-bit BMP: (header, pixel rows)"""
+    h, w = bits.shape
+    stride = ((w + 31) // 32) * 4  # BMP rows are padded to 4 bytes
+    rows = np.zeros((h, stride), np.uint8)
+    rows[::-1, :(w + 7) // 8] = np.packbits(bits, axis=1)  # Rows are stored bottom-up
+    header = _BMP1_HEADERS.get((w, h))
+    if header is None:
+        image = stride * h
+        header = _BMP1_HEADERS[(w, h)] = struct.pack(
+            "<2sIIIIiiHHIIiiII8s", b"BM", 62 + image, 0, 62,
+            40, w, h, 1, 1, 0, image, 3780, 3780, 2, 2,  # 3780 px/m = 96 DPI
+            b"\x00\x00\x00\x00\xff\xff\xff\x00")  # Palette: index 0 black, 1 white
+    return header, rows
+
+# O_BINARY keeps Windows from translating newline bytes in the pixel data
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+class _FileWriter:
+    """Writes queued files, given as byte chunks, on a background thread so rendering never waits on disk"""
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)  # Bounded: rendering stalls before memory does
+        self._errors = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            path, chunks = self._queue.get()
+            try:
+                fd = os.open(path, _WRITE_FLAGS, 0o644)
+                try:
+                    for chunk in chunks:
+                        view = memoryview(chunk).cast("B")
+                        while view:  # os.write may write less than asked
+                            view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def write(self, path, *chunks):
+        self._queue.put((path, chunks))
+
+    def flush(self):
+        """Block until every queued file is written; re-raise the first failure"""
+        self._queue.join()
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+# Per-process state for the page workers: fitz documents can't be pickled,
+# so each worker opens its own handle on a book once and keeps it for its pages
+_worker = {}
+
+def _scratch(name, shape, dtype):
+    """Per-process buffer reused across pages; only valid until the next call for name"""
+    size = int(np.prod(shape))
+    buf = _worker.get(name)
+    if buf is None or buf.size < size or buf.dtype != dtype:
+        buf = _worker[name] = np.empty(max(size, 1), dtype)
+    return buf[:size].reshape(shape)
+
+def _is_blank_page(page, images):
+    """No images, text or vector drawings; the costly drawings list is only built for pages passing the rest"""
+    return not images and not page.get_text("text").strip() and not page.get_drawings()
+
+def _init_page_worker(processor):
+    _worker["processor"] = processor
+    _worker["docs"] = {}
+    _worker["writer"] = _FileWriter()
+
+def _worker_doc(pdf_path):
+    """This worker's handle on pdf_path, opened the first time one of its pages arrives"""
+    docs = _worker["docs"]
+    doc = docs.get(pdf_path)
+    if doc is None:
+        # Books share the pool, so only keep open as many as can render at once
+        while len(docs) >= _worker["processor"].max_concurrent_pdfs:
+            docs.pop(next(iter(docs))).close()
+        doc = docs[pdf_path] = fitz.open(pdf_path)
+    return doc
+
+def _render_batch_worker(pdf_path, batch):
+    doc = _worker_doc(pdf_path)
+    for page_num, output_dir in batch:
+        try:
+            _worker["processor"]._process_page(doc[page_num], page_num, output_dir)
+        except Exception as e:
+            print(f"Page {page_num} error: {str(e)}")
+    try:
+        _worker["writer"].flush()
+    except OSError as e:
+        print(f"Write error: {str(e)}")
+
+# Start render workers from a clean server process (spawn where there is none)
+# instead of forking: the parent runs threads by then, and forking a threaded
+# process is unsafe with PyMuPDF
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+class _ChapterFolders:
+    """Page -> output folder lookup, built once per book from (folder, start, end) ranges.
+
+    Ranges may overlap; as with a scan in order, the first range holding a
+    page wins. Each folder is created the first time a page is given it."""
+
+    def __init__(self, ranges, fallback):
+        # Paint owners last to first so earlier ranges win, then keep only
+        # the pages where the owner changes: O(log chapters) per lookup
+        self._first = min([start for _, start, _ in ranges] + [0])
+        self._last = max([end for _, _, end in ranges] + [-1])
+        owner = np.full(self._last + 1 - self._first, -1, np.int32)
+        for i in range(len(ranges) - 1, -1, -1):
+            _, start, end = ranges[i]
+            if start <= end:
+                owner[start - self._first:end + 1 - self._first] = i
+        runs = np.flatnonzero(np.diff(owner, prepend=-2))
+        self._starts = runs + self._first
+        self._owners = owner[runs].tolist()
+        self._folders = [folder for folder, _, _ in ranges]
+        self._fallback = fallback
+        self._created = set()
+
+    def __call__(self, page_num):
+        folder = self._fallback
+        if self._first <= page_num <= self._last:
+            i = self._owners[int(np.searchsorted(self._starts, page_num, side="right")) - 1]
+            if i >= 0:
+                folder = self._folders[i]
+        if folder not in self._created:
+            os.makedirs(folder, exist_ok=True)
+            self._created.add(folder)
+        return folder
+
 class PDFProcessor:
     def __init__(self):
         self.test_mode = False
         self.test_page_limit = 10
+        self.page_batch_size = 16  # Pages handed to a worker process at a time
+        self.max_concurrent_pdfs = 2  # PDFs rendered at the same time
+        self.screen_long_edge = 320  # Nokia 5310 display is 240x320
+        self.render_overscan = 1.25  # Headroom so the cropped page still fills the screen
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.max_path_length = 200  # Conservative limit for Windows
 
@@ -72,19 +264,37 @@ class PDFProcessor:
                 print("\nExiting...")
                 sys.exit(0)
 
+    def _list_pdfs(self):
+        with os.scandir(self.script_dir) as entries:
+            return [e.name for e in entries if e.name.lower().endswith('.pdf') and e.is_file()]
+
     def process_pdfs(self):
         if not os.path.exists("processed_books"):
             os.makedirs("processed_books")
 
-        for pdf in [f for f in os.listdir(self.script_dir) if f.lower().endswith('.pdf')]:
-            print(f"\nProcessing: {pdf}")
-            try:
-                self._process_pdf(pdf)
-            except Exception as e:
-                print(f"✗ Failed: {str(e)}")
+        pdfs = self._list_pdfs()
+        with self._page_pool() as pool:
+            asyncio.run(self._process_pdfs_concurrently(pool, pdfs))
+
+    async def _process_pdfs_concurrently(self, pool, pdfs):
+        """Process several PDFs at once on one pool, so a book's tail overlaps the next one's start"""
+        limit = asyncio.Semaphore(self.max_concurrent_pdfs)
+        # Books whose names sanitise to the same folder take turns at it
+        folder_locks = {}
+
+        async def process(pdf):
+            folder_lock = folder_locks.setdefault(os.path.normcase(self._book_dir(pdf)), asyncio.Lock())
+            async with folder_lock, limit:
+                print(f"\nProcessing: {pdf}")
+                try:
+                    await asyncio.to_thread(self._process_pdf, pdf, pool)
+                except Exception as e:
+                    print(f"✗ Failed: {pdf}: {str(e)}")
+
+        await asyncio.gather(*(process(pdf) for pdf in pdfs))
 
     def process_specific_chapter(self):
-        pdfs = [f for f in os.listdir(self.script_dir) if f.lower().endswith('.pdf')]
+        pdfs = self._list_pdfs()
         if not pdfs:
             print("No PDFs found in directory!")
             return
@@ -101,20 +311,25 @@ class PDFProcessor:
             return
 
         chapter_num = input("Enter chapter number to process: ").strip()
-        if not chapter_num.isdigit():
+        if not chapter_num.isdecimal():  # isdigit() also passes e.g. '²', which int() rejects
             print("Chapter number must be digits only!")
             return
 
         print(f"\nProcessing chapter {chapter_num} from {selected_pdf}")
         try:
-            self._process_pdf(selected_pdf, specific_chapter=chapter_num)
+            with self._page_pool() as pool:
+                self._process_pdf(selected_pdf, pool, specific_chapter=chapter_num)
         except Exception as e:
             print(f"✗ Failed: {str(e)}")
 
-    def _process_pdf(self, filename, specific_chapter=None):
-        doc = fitz.open(os.path.join(self.script_dir, filename))
+    def _book_dir(self, filename):
+        """Output folder for a PDF, named after its file"""
         book_title = self._sanitize(os.path.splitext(filename)[0])
-        base_dir = os.path.join(self.script_dir, "processed_books", book_title)
+        return os.path.join(self.script_dir, "processed_books", book_title)
+
+    def _process_pdf(self, filename, pool, specific_chapter=None):
+        doc = fitz.open(os.path.join(self.script_dir, filename))
+        base_dir = self._book_dir(filename)
         
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
@@ -125,33 +340,43 @@ class PDFProcessor:
         
         # If processing specific chapter, find its range
         if specific_chapter:
-            chapter_found = False
-            for chapter_name, (start, end) in self._flatten_chapter_ranges(chapter_ranges).items():
-                # Extract all numbers from chapter name
-                chap_numbers = re.findall(r'\d+', chapter_name)
-                # Check if any of them match the requested chapter (with leading zeros stripped)
-                if any(num.lstrip('0') == specific_chapter.lstrip('0') for num in chap_numbers):
-                    print(f"Found chapter: {chapter_name} (pages {start}-{end})")
-                    self._process_chapter(doc, start, end, chapter_name, base_dir, chapter_ranges)
-                    chapter_found = True
-                    break
-            
-            if not chapter_found:
+            # Any number in a chapter's name matches, leading zeros ignored
+            match = self._chapter_number_index(chapter_ranges).get(int(specific_chapter))
+            if match:
+                chapter_name, (start, end) = match
+                print(f"Found chapter: {chapter_name} (pages {start}-{end})")
+                self._process_chapter(pool, doc, start, end, chapter_name, base_dir, chapter_ranges)
+            else:
                 print(f"Chapter {specific_chapter} not found in table of contents!")
             doc.close()
             return
 
         # Process all pages with chapter validation
         max_pages = self.test_page_limit if self.test_mode else len(doc)
-        for page_num in range(min(len(doc), max_pages)):
-            try:
-                chapter_dir = self._get_chapter_folder(page_num, chapter_ranges, base_dir)
-                self._process_page(doc.load_page(page_num), page_num, chapter_dir)
-            except Exception as e:
-                print(f"Page {page_num} error: {str(e)}")
+        folder_for = self._chapter_folders(chapter_ranges, base_dir)
+        jobs = [(page_num, folder_for(page_num))
+                for page_num in range(min(len(doc), max_pages))]
+        self._process_pages(pool, doc.name, jobs)
 
         doc.close()
 
+    def _page_pool(self):
+        """One render process per CPU core, shared by every book in a run"""
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_POOL_CONTEXT,
+                                   initializer=_init_page_worker, initargs=(self,))
+
+    def _process_pages(self, pool, pdf_path, jobs):
+        """Render (page_num, output_dir) jobs in parallel on the shared pool"""
+        # Hand each worker a run of consecutive pages, but keep batches small
+        # enough that short jobs still spread over every core
+        workers = os.cpu_count() or 1
+        size = max(1, min(self.page_batch_size, -(-len(jobs) // workers)))
+        futures = [pool.submit(_render_batch_worker, pdf_path, jobs[i:i + size])
+                   for i in range(0, len(jobs), size)]
+        wait(futures)  # Every batch settles before a failure can unwind the book
+        for future in futures:
+            future.result()
+
     def _flatten_chapter_ranges(self, chapter_ranges):
         """Flatten the chapter ranges structure for easier searching"""
         flat_ranges = {}
@@ -162,16 +387,21 @@ class PDFProcessor:
                 flat_ranges[key] = value
         return flat_ranges
 
-    def _process_chapter(self, doc, start_page, end_page, chapter_name, base_dir, chapter_ranges):
+    def _chapter_number_index(self, chapter_ranges):
+        """Map each number appearing in a chapter name to the first such chapter and its range"""
+        index = {}
+        for chapter_name, page_range in self._flatten_chapter_ranges(chapter_ranges).items():
+            for num in _DIGITS_RE.findall(chapter_name):
+                index.setdefault(int(num), (chapter_name, page_range))
+        return index
+
+    def _process_chapter(self, pool, doc, start_page, end_page, chapter_name, base_dir, chapter_ranges):
         """Process only a specific chapter range"""
-        chapter_dir = self._get_chapter_folder(start_page, chapter_ranges, base_dir)
+        chapter_dir = self._chapter_folders(chapter_ranges, base_dir)(start_page)
         
         print(f"Processing pages {start_page}-{end_page} to {chapter_dir}")
-        for page_num in range(start_page, min(end_page + 1, len(doc))):
-            try:
-                self._process_page(doc.load_page(page_num), page_num, chapter_dir)
-            except Exception as e:
-                print(f"Page {page_num} error: {str(e)}")
+        jobs = [(page_num, chapter_dir) for page_num in range(start_page, min(end_page + 1, len(doc)))]
+        self._process_pages(pool, doc.name, jobs)
 
     def _get_chapter_ranges(self, doc, toc, filename):  # Added filename parameter
         """Returns {chapter_name: (start_page, end_page)} with 4-digit numbering for numbered chapters"""
@@ -193,9 +423,7 @@ class PDFProcessor:
             if entry[0] == 1:  # Level-1 entries are chapters
                 chapter_title = self._sanitize(entry[1])  # Sanitize early!
                 # Check if chapter title contains a number
-                numbers = re.findall(r'\d+', chapter_title)
-                
-                if numbers:
+                if _DIGITS_RE.search(chapter_title):
                     # Format numbers to 4 digits but keep original text
                     numbered_chapters.append((start_page, entry[2] - 2, chapter_title))             #OFFSET ERROR FIX HERE
                 else:
@@ -258,101 +486,101 @@ class PDFProcessor:
         
         return chapters
 
-    def _get_chapter_folder(self, page_num, chapter_ranges, base_dir):
-        """Returns the correct chapter folder for a page, handling part subfolders"""
-        # First check parts (if any)
+    def _chapter_folders(self, chapter_ranges, base_dir):
+        """Returns a page -> chapter folder lookup, handling part subfolders"""
+        ranges = []
         for part_name, part_data in chapter_ranges.items():
             if isinstance(part_data, dict):  # This is a part folder
                 part_path = os.path.join(base_dir, self._sanitize(part_name))
-                os.makedirs(part_path, exist_ok=True)
-                
                 for chapter, (start, end) in part_data.items():
-                    if start <= page_num <= end:
-                        folder = os.path.join(part_path, self._sanitize(chapter))
-                        os.makedirs(folder, exist_ok=True)
-                        return folder
-            else:  # Regular chapter (cover or back)
-                if part_name in ["0000-cover", "9999-back"]:
-                    start, end = part_data
-                    if start <= page_num <= end:
-                        folder = os.path.join(base_dir, part_name)
-                        os.makedirs(folder, exist_ok=True)
-                        return folder
+                    ranges.append((os.path.join(part_path, self._sanitize(chapter)), start, end))
+            elif part_name in ["0000-cover", "9999-back"]:  # Regular chapter (cover or back)
+                start, end = part_data
+                ranges.append((os.path.join(base_dir, part_name), start, end))
         
         # Fallback for any unclassified pages
-        folder = os.path.join(base_dir, "0000-cover")
-        os.makedirs(folder, exist_ok=True)
-        return folder
+        return _ChapterFolders(ranges, os.path.join(base_dir, "0000-cover"))
 
-    def _crop_whitespace(self, img):
-        """Precision four-edge cropping with content detection"""
-        arr = np.array(img.convert("L"))
+    def _crop_whitespace(self, img, scale=1):
+        """Precision four-edge cropping with content detection; scale resizes the 144 DPI pixel limits"""
+        arr = np.asarray(img if img.mode == "L" else img.convert("L"))  # No copy for gray input
         threshold = 220  # Text detection threshold
         margin = int(min(arr.shape) * 0.03)  # 3% protection margin
 
         def find_edge(projection, margin, threshold):
-            for i in range(margin, len(projection) - margin):
-                if projection[i] < threshold:
-                    return max(0, i - margin)
-            return margin
+            # Offset of the first content row/column past the margin, found in C
+            window = projection[margin:len(projection) - margin]
+            hits = np.less(window, threshold, out=_scratch("hits", window.shape, np.bool_))
+            if not hits.any():
+                return margin
+            return int(hits.argmax())
 
-        h_proj = np.min(arr, axis=1)
-        v_proj = np.min(arr, axis=0)
+        h_proj = np.min(arr, axis=1, out=_scratch("h_proj", arr.shape[0], arr.dtype))
+        v_proj = np.min(arr, axis=0, out=_scratch("v_proj", arr.shape[1], arr.dtype))
 
         top = find_edge(h_proj, margin, threshold)
         bottom = arr.shape[0] - find_edge(h_proj[::-1], margin, threshold)
         left = find_edge(v_proj, margin, threshold)
         right = arr.shape[1] - find_edge(v_proj[::-1], margin, threshold)
 
-        if (right - left) < 50 or (bottom - top) < 50:
+        min_size = 50 * scale  # 50px at 144 DPI
+        if (right - left) < min_size or (bottom - top) < min_size:
             return img
         
         return img.crop((left, top, right, bottom))
 
     def _process_page(self, page, page_num, output_dir):
-        pix = page.get_pixmap(dpi=144)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        gray = ImageOps.autocontrast(img.convert("L"), cutoff=5)
+        # Blank pages (chapter-end fillers) have no text, images or vector
+        # drawings; checking that is far cheaper than rasterising them
+        images = page.get_images()
+        if _is_blank_page(page, images):
+            return
+
+        # Render straight at Nokia resolution: the page width becomes the
+        # screen's long edge once the halves are rotated
+        # Pages in a book nearly all share one width, so build its Matrix once
+        matrices = _worker.setdefault("matrices", {})
+        matrix = matrices.get(page.rect.width)
+        if matrix is None:
+            zoom = self.screen_long_edge * self.render_overscan / page.rect.width
+            matrix = matrices[page.rect.width] = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+        # Pixel sizes below were tuned on 144 DPI renders (2 px per point);
+        # scale them so they cover the same area of the page at this zoom
+        scale = matrix.a / 2
+        # pix.samples is already a bytes copy of the pixmap; wrap that copy rather than making another
+        img = Image.frombuffer("L", (pix.width, pix.height), pix.samples, "raw", "L", 0, 1)
+        gray = ImageOps.autocontrast(img, cutoff=5)
         
-        cropped = self._crop_whitespace(gray)
+        cropped = self._crop_whitespace(gray, scale)
         if not cropped:
             cropped = gray
 
-        width, height = cropped.size
+        # Splits are views into one array instead of two PIL crops
+        arr = np.asarray(cropped)
+        height = arr.shape[0]
 
-        top_split = cropped.crop((
-            0,
-            0,
-            width,
-            int(height * 0.55)
-        ))
-        
-        bottom_split = cropped.crop((
-            0,
-            int(height * 0.45),
-            width,
-            height
-        ))
-
-        def save_split(img, suffix):
+        top_split = arr[:int(height * 0.55)]
+        bottom_split = arr[int(height * 0.45):]
+
+        def save_split(split, suffix):
             output_path = os.path.join(output_dir, f"{page_num+1:04d}{suffix}.bmp")
             # Ensure path isn't too long
             if len(output_path) > self.max_path_length:
                 output_path = output_path[:self.max_path_length-4] + ".bmp"
-            img.convert("1", dither=Image.FLOYDSTEINBERG) \
-               .transpose(Image.ROTATE_270) \
-               .save(output_path)
+            rotated = np.rot90(_dither_1bit(split), k=-1)  # Same as ROTATE_270, as a view
+            _worker["writer"].write(output_path, *_bmp1_parts(rotated))
             return output_path
 
-        if np.array(top_split.convert("L")).min() < 240:
+        if top_split.min() < 240:
             save_split(top_split, "a")
-        if np.array(bottom_split.convert("L")).min() < 240:
+        if bottom_split.min() < 240:
             save_split(bottom_split, "b")
 
     def _sanitize(self, text):
         """Enhanced sanitization for Windows paths with length limits"""
         # Remove all problematic characters
-        sanitized = re.sub(r'[\\/*?:"<>|()…]', "", text)
+        sanitized = _SANITIZE_RE.sub("", text)
         # Replace spaces with underscores
         sanitized = sanitized.replace(" ", "_")
         # Trim to reasonable length (leave room for path components)
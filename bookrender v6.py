@@ -1,7 +1,15 @@
+import asyncio
+import io
+import multiprocessing
 import os
 import re
 import sys
 import shutil
+import queue
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import lru_cache
 import numpy as np
 import fitz  # PyMuPDF
 from PIL import Image, ImageOps, ImageDraw, ImageFont
@@ -10,12 +18,341 @@ from ebooklib import epub
 from bs4 import BeautifulSoup
 import html2text
 
+_DIGITS_RE = re.compile(r'\d+')
+_NUMBERED_RE = re.compile(r'\b(ch|chapter)\s*\d+', re.I)
+_CHAPTER_NUM_RE = re.compile(r'\b(chapter|ch)\s*(\d+)\b', re.I)
+_SANITIZE_TABLE = str.maketrans("", "", '\\/*?:"<>|()…')  # Characters that break Windows paths
+_CONTROL_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+def _clean_title(text):
+    """Title on one line: control characters and newlines become spaces, runs of spaces one"""
+    return " ".join(_CONTROL_RE.sub(" ", text).split())
+
+@lru_cache(maxsize=4096)  # The same chapter and part names come back for every page
+def _sanitize_name(text):
+    # Remove all problematic characters, then replace spaces with underscores
+    sanitized = _clean_title(text).translate(_SANITIZE_TABLE).replace(" ", "_")
+    # Trim to reasonable length (leave room for path components)
+    max_length = 50  # Conservative limit for individual folder names
+    return sanitized[:max_length]
+
+_BMP1_HEADERS = {}  # (width, height) -> file header, info header and palette
+
+def _bmp1_header(w, h):
+    """File header, info header and palette (black, white) for a w x h 1-bit BMP"""
+    header = _BMP1_HEADERS.get((w, h))
+    if header is None:
+        image = ((w + 31) // 32) * 4 * h
+        header = _BMP1_HEADERS[(w, h)] = struct.pack(
+            "<2sIIIIiiHHIIiiII8s", b"BM", 62 + image, 0, 62,
+            40, w, h, 1, 1, 0, image, 3780, 3780, 2, 2,  # 3780 px/m = 96 DPI, as PIL writes
+            b"\x00\x00\x00\x00\xff\xff\xff\x00")
+    return header
+
+# O_BINARY keeps Windows from translating newline bytes in the pixel data
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+class _FileWriter:
+    """Writes queued files, given as byte chunks, on a background thread so rendering never waits on disk"""
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)  # Bounded: rendering stalls before memory does
+        self._errors = []
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            path, chunks = self._queue.get()
+            try:
+                fd = os.open(path, _WRITE_FLAGS, 0o644)
+                try:
+                    for chunk in chunks:
+                        view = memoryview(chunk).cast("B")
+                        while view:  # os.write may write less than asked
+                            view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def write(self, path, *chunks):
+        self._queue.put((path, chunks))
+
+    def flush(self):
+        """Block until every queued file is written; re-raise the first failure"""
+        self._queue.join()
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy edge scan is used without it
+    njit = None
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False)
+    def _crop_edges(arr, threshold, margin):
+        """Whitespace crop box (top, bottom, left, right), scanning each edge once"""
+        h, w = arr.shape
+        top, bottom, left, right = margin, h - margin, margin, w - margin
+        for i in range(margin, h - margin):  # Rows stop at the first content pixel
+            if arr[i].min() < threshold:
+                top = i - margin
+                break
+        for i in range(margin, h - margin):
+            if arr[h - 1 - i].min() < threshold:
+                bottom = h - (i - margin)
+                break
+        cols = np.full(w, 255, np.uint8)  # Column minima, built row by row in memory order
+        for y in range(h):
+            for x in range(w):
+                if arr[y, x] < cols[x]:
+                    cols[x] = arr[y, x]
+        for i in range(margin, w - margin):
+            if cols[i] < threshold:
+                left = i - margin
+                break
+        for i in range(margin, w - margin):
+            if cols[w - 1 - i] < threshold:
+                right = w - (i - margin)
+                break
+        return top, bottom, left, right
+
+    @njit(cache=True, boundscheck=False)
+    def _autocontrast_gray(rgb, gray, cutoff):
+        """RGB -> L into gray, then ImageOps.autocontrast(cutoff), with PIL's exact integer maths"""
+        h, w = gray.shape
+        hist = np.zeros(256, np.int64)  # Built during the conversion pass
+        for y in range(h):
+            for x in range(w):
+                l = (rgb[y, x, 0] * 19595 + rgb[y, x, 1] * 38470 + rgb[y, x, 2] * 7471 + 0x8000) >> 16
+                gray[y, x] = l
+                hist[l] += 1
+        # Drop cutoff% of the pixels from each end of the histogram
+        n = hist.sum()
+        cut = n * cutoff // 100
+        for lo in range(256):
+            if cut > hist[lo]:
+                cut -= hist[lo]
+                hist[lo] = 0
+            else:
+                hist[lo] -= cut
+                cut = 0
+            if cut <= 0:
+                break
+        cut = n * cutoff // 100
+        for hi in range(255, -1, -1):
+            if cut > hist[hi]:
+                cut -= hist[hi]
+                hist[hi] = 0
+            else:
+                hist[hi] -= cut
+                cut = 0
+            if cut <= 0:
+                break
+        lo, hi = 0, 255
+        while lo < 255 and hist[lo] == 0:
+            lo += 1
+        while hi > 0 and hist[hi] == 0:
+            hi -= 1
+        if hi > lo:  # Otherwise PIL leaves the image as it is
+            scale = 255.0 / (hi - lo)
+            offset = -lo * scale
+            lut = np.empty(256, np.uint8)
+            for ix in range(256):
+                lut[ix] = min(max(int(ix * scale + offset), 0), 255)
+            for y in range(h):
+                for x in range(w):
+                    gray[y, x] = lut[gray[y, x]]
+
+    @njit(cache=True, boundscheck=False)
+    def _fs_dither_bmp1_rotated(gray, rows):
+        """Floyd-Steinberg dither (same integer maths as PIL) straight into BMP rows rotated 270 degrees
+
+        Rows go in pairs: the second trails the first by one pixel and takes the
+        first row's error from registers, so only every other row's error is
+        stored to and reloaded from memory"""
+        h, w = gray.shape
+        errors = np.zeros(w + 1, np.int32)  # Next row's error, 16x fixed point
+        for y in range(0, h, 2):
+            pair = y + 1 < h
+            # Row y is rotated column h-1-y, row y+1 the column to its left
+            byte_a, bit_a = (h - 1 - y) >> 3, np.uint8(0x80 >> ((h - 1 - y) & 7))
+            byte_b, bit_b = (h - 2 - y) >> 3, np.uint8(0x80 >> ((h - 2 - y) & 7))
+            a = a0 = a1 = 0
+            b = b0 = b1 = 0
+            for x in range(w + 1):
+                if x < w:
+                    e = a + errors[x + 1]
+                    e = e // 16 if e >= 0 else -(-e // 16)  # C-style truncation
+                    a = min(max(gray[y, x] + e, 0), 255)
+                    if a > 128:
+                        rows[w - 1 - x, byte_a] |= bit_a  # Rotated row x, stored bottom-up
+                        a -= 255
+                    # Spread 7/16 right, 3/16, 5/16, 1/16 onto the next row
+                    a2 = a
+                    d2 = a + a
+                    a += d2
+                    below = a + a0
+                    a += d2
+                    a0 = a + a1
+                    a1 = a2
+                    a += d2
+                else:
+                    below = a0
+                if pair and x > 0:
+                    # Row y+1, pixel x-1: below is complete once row y is past x
+                    e = b + below
+                    e = e // 16 if e >= 0 else -(-e // 16)
+                    b = min(max(gray[y + 1, x - 1] + e, 0), 255)
+                    if b > 128:
+                        rows[w - x, byte_b] |= bit_b
+                        b -= 255
+                    b2 = b
+                    d2 = b + b
+                    b += d2
+                    errors[x - 1] = b + b0
+                    b += d2
+                    b0 = b + b1
+                    b1 = b2
+                    b += d2
+            if pair:
+                errors[w] = b0
+
+    @njit(cache=True, boundscheck=False)
+    def _dither_band(band, buf):
+        """A band's BMP rows (dithered, rotated 270 degrees) laid out in buf, or none if nothing is darker than 240"""
+        if band.size == 0 or band.min() >= 240:
+            return buf[:0].reshape((0, 0))
+        h, w = band.shape  # The rotated image is h wide and w tall
+        rows = buf[:w * (((h + 31) // 32) * 4)].reshape((w, ((h + 31) // 32) * 4))
+        rows[:] = 0
+        _fs_dither_bmp1_rotated(band, rows)
+        return rows
+
+    @njit(cache=True, boundscheck=False)
+    def _render_splits(rgb, gray, top_buf, bottom_buf, cutoff, threshold, min_size):
+        """The whole page in one call: gray, autocontrast, crop, 55%/45% split and dither.
+
+        Returns each band's BMP rows and its height, the rotated BMP's width"""
+        _autocontrast_gray(rgb, gray, cutoff)
+        h, w = gray.shape
+        top, bottom, left, right = _crop_edges(gray, threshold, int(min(h, w) * 0.03))
+        if (right - left) < min_size or (bottom - top) < min_size:
+            top, bottom, left, right = 0, h, 0, w  # Crop too aggressive: keep the page
+        cropped = gray[top:bottom, left:right]
+        height = cropped.shape[0]
+        top_split = cropped[:int(height * 0.55)]
+        bottom_split = cropped[int(height * 0.45):]
+        return (_dither_band(top_split, top_buf), top_split.shape[0],
+                _dither_band(bottom_split, bottom_buf), bottom_split.shape[0])
+
+# Per-process state for the page workers: fitz documents can't be pickled,
+# so each worker opens its own handle once and keeps it for every page
+_worker = {}
+
+def _scratch(name, shape, dtype):
+    """Per-process buffer reused across pages; only valid until the next call for name"""
+    size = int(np.prod(shape))
+    buf = _worker.get(name)
+    if buf is None or buf.size < size or buf.dtype != dtype:
+        buf = _worker[name] = np.empty(max(size, 1), dtype)
+    return buf[:size].reshape(shape)
+
+def _is_blank_page(page, images):
+    """No images, text or vector drawings; the costly drawings list is only built for pages passing the rest"""
+    return not images and not page.get_text("text").strip() and not page.get_drawings()
+
+def _init_page_worker(processor):
+    _worker["processor"] = processor
+    _worker["docs"] = {}
+    _worker["writer"] = _FileWriter()
+
+def _worker_doc(pdf_path):
+    """This worker's handle on pdf_path, opened the first time one of its pages arrives"""
+    docs = _worker["docs"]
+    doc = docs.get(pdf_path)
+    if doc is None:
+        # Books share the pool, so only keep open as many as can render at once
+        while len(docs) >= _worker["processor"].max_concurrent_pdfs:
+            docs.pop(next(iter(docs))).close()
+        doc = docs[pdf_path] = fitz.open(pdf_path)
+    return doc
+
+def _render_batch_worker(pdf_path, batch):
+    doc = _worker_doc(pdf_path)
+    for page_num, output_dir in batch:
+        try:
+            _worker["processor"]._process_page(doc.load_page(page_num), page_num, output_dir)
+        except Exception as e:
+            print(f"Page {page_num} error: {str(e)}")
+    try:
+        _worker["writer"].flush()
+    except OSError as e:
+        print(f"Write error: {str(e)}")
+
+def _scan_headings_batch(pdf_path, page_nums):
+    """(page_num, heading) for each page of the batch whose fonts mark a chapter start"""
+    doc = _worker_doc(pdf_path)
+    processor = _worker["processor"]
+    found = []
+    for page_num in page_nums:
+        page = doc.load_page(page_num)
+        # One text extraction serves both the heading and the chapter-start check
+        blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)["blocks"]
+        heading = processor._extract_heading_from_page(page, blocks)
+        if heading and processor._is_chapter_start_page(page, heading, blocks):
+            found.append((page_num, heading))
+    return found
+
+# Start render workers from a clean server process (spawn where there is none)
+# instead of forking: the parent runs threads by then, and forking a threaded
+# process is unsafe with PyMuPDF
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+class _ChapterFolders:
+    """Page -> output folder lookup, built once per book from (folder, start, end) ranges.
+
+    Ranges may overlap; as with a scan in order, the first range holding a
+    page wins."""
+
+    def __init__(self, ranges, fallback):
+        # Paint owners last to first so earlier ranges win, then keep only
+        # the pages where the owner changes: O(log chapters) per lookup
+        self._first = min([start for _, start, _ in ranges] + [0])
+        self._last = max([end for _, _, end in ranges] + [-1])
+        owner = np.full(self._last + 1 - self._first, -1, np.int32)
+        for i in range(len(ranges) - 1, -1, -1):
+            _, start, end = ranges[i]
+            if start <= end:
+                owner[start - self._first:end + 1 - self._first] = i
+        runs = np.flatnonzero(np.diff(owner, prepend=-2))
+        self._starts = runs + self._first
+        self._owners = owner[runs].tolist()
+        self._folders = [folder for folder, _, _ in ranges]
+        self._fallback = fallback
+
+    def __call__(self, page_num):
+        if self._first <= page_num <= self._last:
+            i = self._owners[int(np.searchsorted(self._starts, page_num, side="right")) - 1]
+            if i >= 0:
+                return self._folders[i]
+        return self._fallback
+
 class DocumentProcessor:
     def __init__(self):
         self.test_mode = False
         self.test_page_limit = 10
+        self.page_batch_size = 16  # Pages handed to a worker process at a time
+        self.max_concurrent_pdfs = 2  # PDFs rendered at the same time
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.max_path_length = 200  # Conservative limit for Windows
+        self.screen_long_edge = 320  # Nokia 5310 display is 240x320
+        self.render_overscan = 1.25  # Headroom so the cropped page still fills the screen
         self.heading_font_threshold = 20  # Minimum font size to consider as heading
         self.heading_bold_threshold = 0.7  # Minimum boldness to consider as heading
         self.chapter_start_threshold = 0.8  # Confidence threshold for chapter start page
@@ -46,21 +383,38 @@ class DocumentProcessor:
         if not os.path.exists("processed_books"):
             os.makedirs("processed_books")
 
-        # Process PDFs
-        for pdf in [f for f in os.listdir(self.script_dir) if f.lower().endswith('.pdf')]:
-            print(f"\nProcessing PDF: {pdf}")
-            try:
-                self._process_pdf(pdf)
-            except Exception as e:
-                print(f"✗ Failed: {str(e)}")
-        
-        # Process EPUBs
-        for epub_file in [f for f in os.listdir(self.script_dir) if f.lower().endswith('.epub')]:
-            print(f"\nProcessing EPUB: {epub_file}")
-            try:
-                self._process_epub(epub_file)
-            except Exception as e:
-                print(f"✗ Failed: {str(e)}")
+        # PDFs first, then EPUBs
+        files = os.listdir(self.script_dir)
+        documents = ([f for f in files if f.lower().endswith('.pdf')]
+                     + [f for f in files if f.lower().endswith('.epub')])
+        with self._page_pool() as pool:
+            asyncio.run(self._process_documents_concurrently(pool, documents))
+
+    async def _process_documents_concurrently(self, pool, documents):
+        """Process several books at once on one pool, so a book's tail overlaps the next one's start"""
+        limit = asyncio.Semaphore(self.max_concurrent_pdfs)
+        # Books whose names sanitise to the same folder (a PDF and EPUB of one title) take turns at it
+        folder_locks = {}
+
+        async def process(document):
+            folder_lock = folder_locks.setdefault(os.path.normcase(self._book_dir(document)), asyncio.Lock())
+            async with folder_lock, limit:
+                try:
+                    if document.lower().endswith('.pdf'):
+                        print(f"\nProcessing PDF: {document}")
+                        await asyncio.to_thread(self._process_pdf, document, pool)
+                    else:
+                        print(f"\nProcessing EPUB: {document}")
+                        await asyncio.to_thread(self._process_epub, document)
+                except Exception as e:
+                    print(f"✗ Failed: {document}: {str(e)}")
+
+        await asyncio.gather(*(process(document) for document in documents))
+
+    def _book_dir(self, filename):
+        """Output folder for a PDF or EPUB, named after its file"""
+        book_title = self._sanitize(os.path.splitext(filename)[0])
+        return os.path.join(self.script_dir, "processed_books", book_title)
 
     def process_specific_chapter(self):
         # Get both PDF and EPUB files
@@ -91,7 +445,8 @@ class DocumentProcessor:
         print(f"\nProcessing chapter {chapter_num} from {selected_doc}")
         try:
             if selected_doc.lower().endswith('.pdf'):
-                self._process_pdf(selected_doc, specific_chapter=chapter_num)
+                with self._page_pool() as pool:
+                    self._process_pdf(selected_doc, pool, specific_chapter=chapter_num)
             else:
                 self._process_epub(selected_doc, specific_chapter=chapter_num)
         except Exception as e:
@@ -100,8 +455,7 @@ class DocumentProcessor:
     def _process_epub(self, filename, specific_chapter=None):
         """Process an EPUB file and convert it to images for Nokia 5310"""
         book = epub.read_epub(os.path.join(self.script_dir, filename))
-        book_title = self._sanitize(os.path.splitext(filename)[0])
-        base_dir = os.path.join(self.script_dir, "processed_books", book_title)
+        base_dir = self._book_dir(filename)
         
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
@@ -114,7 +468,7 @@ class DocumentProcessor:
             chapter_found = False
             for i, (chapter_name, content) in enumerate(chapters):
                 # Extract all numbers from chapter name
-                chap_numbers = re.findall(r'\d+', chapter_name)
+                chap_numbers = _DIGITS_RE.findall(chapter_name)
                 # Check if any of them match the requested chapter (with leading zeros stripped)
                 if any(num.lstrip('0') == specific_chapter.lstrip('0') for num in chap_numbers):
                     print(f"Found chapter: {chapter_name}")
@@ -195,19 +549,20 @@ class DocumentProcessor:
             img = self._render_text_to_image(page_text, chapter_name if i == 0 else "")
             if img:
                 # Split into top and bottom parts like the PDF processor
-                width, height = img.size
+                arr = np.asarray(img)
+                height = arr.shape[0]
                 
-                top_split = img.crop((0, 0, width, int(height * 0.55)))
-                bottom_split = img.crop((0, int(height * 0.45), width, height))
+                top_split = arr[:int(height * 0.55)]
+                bottom_split = arr[int(height * 0.45):]
                 
                 # Save both parts as BMP files
-                if np.array(top_split.convert("L")).min() < 240:
+                if top_split.min() < 240:
                     output_path = os.path.join(output_dir, f"{i+1:04d}a.bmp")
-                    top_split.convert("1", dither=Image.FLOYDSTEINBERG).transpose(Image.ROTATE_270).save(output_path)
+                    Image.fromarray(top_split).convert("1", dither=Image.FLOYDSTEINBERG).transpose(Image.ROTATE_270).save(output_path)
                 
-                if np.array(bottom_split.convert("L")).min() < 240:
+                if bottom_split.min() < 240:
                     output_path = os.path.join(output_dir, f"{i+1:04d}b.bmp")
-                    bottom_split.convert("1", dither=Image.FLOYDSTEINBERG).transpose(Image.ROTATE_270).save(output_path)
+                    Image.fromarray(bottom_split).convert("1", dither=Image.FLOYDSTEINBERG).transpose(Image.ROTATE_270).save(output_path)
 
     def _render_text_to_image(self, text, heading=""):
         """Render text to image with proper formatting for Nokia 5310"""
@@ -277,27 +632,26 @@ class DocumentProcessor:
         
         return img
 
-    def _process_pdf(self, filename, specific_chapter=None):
+    def _process_pdf(self, filename, pool, specific_chapter=None):
         doc = fitz.open(os.path.join(self.script_dir, filename))
-        book_title = self._sanitize(os.path.splitext(filename)[0])
-        base_dir = os.path.join(self.script_dir, "processed_books", book_title)
+        base_dir = self._book_dir(filename)
         
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
 
         # Extract headings and create chapter ranges
-        chapter_ranges = self._extract_headings_and_create_toc(doc)
+        chapter_ranges = self._extract_headings_and_create_toc(doc, pool)
         
         # If processing specific chapter, find its range
         if specific_chapter:
             chapter_found = False
             for chapter_name, (start, end) in self._flatten_chapter_ranges(chapter_ranges).items():
                 # Extract all numbers from chapter name
-                chap_numbers = re.findall(r'\d+', chapter_name)
+                chap_numbers = _DIGITS_RE.findall(chapter_name)
                 # Check if any of them match the requested chapter (with leading zeros stripped)
                 if any(num.lstrip('0') == specific_chapter.lstrip('0') for num in chap_numbers):
                     print(f"Found chapter: {chapter_name} (pages {start}-{end})")
-                    self._process_chapter(doc, start, end, chapter_name, base_dir, chapter_ranges)
+                    self._process_chapter(pool, doc, start, end, chapter_name, base_dir, chapter_ranges)
                     chapter_found = True
                     break
             
@@ -308,32 +662,60 @@ class DocumentProcessor:
 
         # Process all pages with chapter validation
         max_pages = self.test_page_limit if self.test_mode else len(doc)
-        for page_num in range(min(len(doc), max_pages)):
-            try:
-                chapter_dir = self._get_chapter_folder(page_num, chapter_ranges, base_dir)
-                self._process_page(doc.load_page(page_num), page_num, chapter_dir)
-            except Exception as e:
-                print(f"Page {page_num} error: {str(e)}")
+        folder_for = self._chapter_folders(chapter_ranges, base_dir)
+        jobs = [(page_num, folder_for(page_num)) for page_num in range(min(len(doc), max_pages))]
+        self._process_pages(pool, doc.name, jobs)
 
         doc.close()
 
-    def _extract_headings_and_create_toc(self, doc):
+    def _page_pool(self):
+        """One render process per CPU core, shared by every book in a run"""
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_POOL_CONTEXT,
+                                   initializer=_init_page_worker, initargs=(self,))
+
+    def _process_pages(self, pool, pdf_path, jobs):
+        """Render (page_num, output_dir) jobs in parallel on the shared pool"""
+        # Hand each worker a run of consecutive pages, but keep batches small
+        # enough that short jobs still spread over every core
+        workers = os.cpu_count() or 1
+        size = max(1, min(self.page_batch_size, -(-len(jobs) // workers)))
+        for output_dir in {output_dir for _, output_dir in jobs}:  # Each folder once, not per page
+            os.makedirs(output_dir, exist_ok=True)
+        futures = [pool.submit(_render_batch_worker, pdf_path, jobs[i:i + size])
+                   for i in range(0, len(jobs), size)]
+        wait(futures)  # Every batch settles before a failure can unwind the book
+        for future in futures:
+            future.result()
+
+    def _extract_headings_and_create_toc(self, doc, pool):
         """Manually extract headings from PDF and create a table of contents"""
         headings = []
-        current_page = 0
         total_pages = len(doc)
         
-        while current_page < total_pages:
-            page = doc.load_page(current_page)
-            heading = self._extract_heading_from_page(page)
-            
-            if heading:
-                # Check if this is likely a chapter start page
-                if self._is_chapter_start_page(page, heading):
-                    headings.append((current_page, heading))
-                    # Skip ahead to avoid detecting subheadings
-                    current_page += 1
-            current_page += 1
+        # Prefer the PDF's own outline: it needs no per-page text extraction.
+        # Keep level-1 entries with a real target, in ascending page order
+        for level, title, page_num in doc.get_toc(simple=True):
+            title = _clean_title(title)  # Outline titles can carry newlines and control characters
+            if (level == 1 and title and 1 <= page_num <= total_pages
+                    and (not headings or page_num - 1 > headings[-1][0])):
+                headings.append((page_num - 1, title))
+        
+        # No outline, or one without a single numbered ("Chapter N") title, which
+        # would send every page to back matter: fall back to scanning fonts
+        scan_fonts = not any(self._is_numbered_chapter(self._format_chapter_heading(heading))
+                             for _, heading in headings)
+        if scan_fonts:
+            headings = []
+            # Scan every page's fonts on the page pool, then walk the hits in order
+            workers = os.cpu_count() or 1
+            size = max(1, min(self.page_batch_size, -(-total_pages // workers)))
+            futures = [pool.submit(_scan_headings_batch, doc.name, range(i, min(i + size, total_pages)))
+                       for i in range(0, total_pages, size)]
+            for future in futures:
+                for page_num, heading in future.result():
+                    # The page after a chapter start is skipped to avoid detecting subheadings
+                    if not headings or page_num > headings[-1][0] + 1:
+                        headings.append((page_num, heading))
         
         # Process the headings to create chapter ranges
         chapter_ranges = {}
@@ -417,10 +799,10 @@ class DocumentProcessor:
 
         return chapter_ranges
 
-    def _extract_heading_from_page(self, page):
+    def _extract_heading_from_page(self, page, blocks=None):
         """Extract the main heading from a page by analyzing text properties"""
-        blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)["blocks"]
-        potential_headings = []
+        if blocks is None:
+            blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)["blocks"]
         
         for block in blocks:
             if "lines" in block:
@@ -430,17 +812,15 @@ class DocumentProcessor:
                         if (span["size"] >= self.heading_font_threshold and 
                             span["flags"] & 2**4 and  # Bold flag
                             len(span["text"].strip()) > 3):  # Minimum length
-                            potential_headings.append(span["text"].strip())
-        
-        if potential_headings:
-            # Return the largest (first) heading
-            return potential_headings[0]
+                            # The first heading is the one used; stop looking
+                            return span["text"].strip()
         return None
 
-    def _is_chapter_start_page(self, page, heading):
+    def _is_chapter_start_page(self, page, heading, blocks=None):
         """Determine if this is likely a chapter start page"""
         # Check if heading is at the top of the page
-        blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)["blocks"]
+        if blocks is None:
+            blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_IMAGES)["blocks"]
         if blocks and "lines" in blocks[0]:
             first_line = blocks[0]["lines"][0]
             for span in first_line["spans"]:
@@ -452,25 +832,12 @@ class DocumentProcessor:
 
     def _is_numbered_chapter(self, heading):
         """Check if the heading contains a chapter number"""
-        return bool(re.search(r'\b(ch|chapter)\s*\d+', heading, re.I))
+        return bool(_NUMBERED_RE.search(heading))
 
     def _format_chapter_heading(self, heading):
         """Format chapter numbers to 4 digits with 'ch' prefix"""
-        # Find all number patterns
-        matches = list(re.finditer(r'\b(chapter|ch)\s*(\d+)\b', heading, re.I))
-        
-        if not matches:
-            return heading
-        
-        # Process each match
-        new_heading = heading
-        for match in reversed(matches):  # Process from end to avoid index issues
-            full_match, prefix, num = match.group(0), match.group(1), match.group(2)
-            # Format to 4 digits with 'ch' prefix
-            replacement = f"ch {int(num):04d}"
-            new_heading = new_heading[:match.start()] + replacement + new_heading[match.end():]
-        
-        return new_heading
+        # One pass over the heading; every match is rewritten as "ch NNNN"
+        return _CHAPTER_NUM_RE.sub(lambda match: f"ch {int(match.group(2)):04d}", heading)
 
     def _flatten_chapter_ranges(self, chapter_ranges):
         """Flatten the chapter ranges structure for easier searching"""
@@ -482,58 +849,47 @@ class DocumentProcessor:
                 flat_ranges[key] = value
         return flat_ranges
 
-    def _process_chapter(self, doc, start_page, end_page, chapter_name, base_dir, chapter_ranges):
+    def _process_chapter(self, pool, doc, start_page, end_page, chapter_name, base_dir, chapter_ranges):
         """Process only a specific chapter range"""
-        chapter_dir = self._get_chapter_folder(start_page, chapter_ranges, base_dir)
+        chapter_dir = self._chapter_folders(chapter_ranges, base_dir)(start_page)
         
         print(f"Processing pages {start_page}-{end_page} to {chapter_dir}")
-        for page_num in range(start_page, min(end_page + 1, len(doc))):
-            try:
-                self._process_page(doc.load_page(page_num), page_num, chapter_dir)
-            except Exception as e:
-                print(f"Page {page_num} error: {str(e)}")
+        jobs = [(page_num, chapter_dir) for page_num in range(start_page, min(end_page + 1, len(doc)))]
+        self._process_pages(pool, doc.name, jobs)
 
     def _get_chapter_ranges(self, doc, toc, filename):
         """Legacy method kept for compatibility"""
-        return self._extract_headings_and_create_toc(doc)
+        with self._page_pool() as pool:
+            return self._extract_headings_and_create_toc(doc, pool)
 
-    def _get_chapter_folder(self, page_num, chapter_ranges, base_dir):
-        """Returns the correct chapter folder for a page, handling part subfolders"""
-        # First check parts (if any)
+    def _chapter_folders(self, chapter_ranges, base_dir):
+        """Returns a page -> chapter folder lookup, handling part subfolders"""
+        ranges = []
         for part_name, part_data in chapter_ranges.items():
             if isinstance(part_data, dict):  # This is a part folder
                 part_path = os.path.join(base_dir, self._sanitize(part_name))
-                os.makedirs(part_path, exist_ok=True)
-                
                 for chapter, (start, end) in part_data.items():
-                    if start <= page_num <= end:
-                        folder = os.path.join(part_path, self._sanitize(chapter))
-                        os.makedirs(folder, exist_ok=True)
-                        return folder
-            else:  # Regular chapter (cover or back)
-                if part_name in ["0000_cover", "9999_back"]:
-                    start, end = part_data
-                    if start <= page_num <= end:
-                        folder = os.path.join(base_dir, part_name)
-                        os.makedirs(folder, exist_ok=True)
-                        return folder
+                    ranges.append((os.path.join(part_path, self._sanitize(chapter)), start, end))
+            elif part_name in ["0000_cover", "9999_back"]:  # Regular chapter (cover or back)
+                start, end = part_data
+                ranges.append((os.path.join(base_dir, part_name), start, end))
         
         # Fallback for any unclassified pages
-        folder = os.path.join(base_dir, "0000_cover")
-        os.makedirs(folder, exist_ok=True)
-        return folder
+        return _ChapterFolders(ranges, os.path.join(base_dir, "0000_cover"))
 
-    def _crop_whitespace(self, img):
-        """Precision four-edge cropping with content detection"""
-        arr = np.array(img.convert("L"))
+    def _crop_whitespace(self, arr, scale=1):
+        """Four-edge content crop, as a view into the gray page array; scale resizes the 144 DPI pixel limit.
+
+        Only used without numba: _render_splits crops with _crop_edges."""
         threshold = 220  # Text detection threshold
         margin = int(min(arr.shape) * 0.03)  # 3% protection margin
 
         def find_edge(projection, margin, threshold):
-            for i in range(margin, len(projection) - margin):
-                if projection[i] < threshold:
-                    return max(0, i - margin)
-            return margin
+            # Offset of the first content row/column past the margin, found in C
+            hits = projection[margin:len(projection) - margin] < threshold
+            if not hits.any():
+                return margin
+            return int(hits.argmax())
 
         h_proj = np.min(arr, axis=1)
         v_proj = np.min(arr, axis=0)
@@ -543,60 +899,78 @@ class DocumentProcessor:
         left = find_edge(v_proj, margin, threshold)
         right = arr.shape[1] - find_edge(v_proj[::-1], margin, threshold)
 
-        if (right - left) < 50 or (bottom - top) < 50:
-            return img
+        min_size = 50 * scale  # 50px at 144 DPI, as in _render_splits
+        if (right - left) < min_size or (bottom - top) < min_size:
+            return arr
         
-        return img.crop((left, top, right, bottom))
+        return arr[top:bottom, left:right]
 
     def _process_page(self, page, page_num, output_dir):
-        pix = page.get_pixmap(dpi=144)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        gray = ImageOps.autocontrast(img.convert("L"), cutoff=5)
-        
-        cropped = self._crop_whitespace(gray)
-        if not cropped:
-            cropped = gray
-
-        width, height = cropped.size
-
-        top_split = cropped.crop((
-            0,
-            0,
-            width,
-            int(height * 0.55)
-        ))
-        
-        bottom_split = cropped.crop((
-            0,
-            int(height * 0.45),
-            width,
-            height
-        ))
+        # Blank pages (chapter-end fillers) have no text, images or vector
+        # drawings; checking that is far cheaper than rasterising them
+        images = page.get_images()
+        if _is_blank_page(page, images):
+            return
 
-        def save_split(img, suffix):
+        # Render straight at Nokia resolution: the page width becomes the
+        # screen's long edge once the halves are rotated
+        # Pages in a book nearly all share one width, so build its Matrix once
+        matrices = _worker.setdefault("matrices", {})
+        matrix = matrices.get(page.rect.width)
+        if matrix is None:
+            zoom = self.screen_long_edge * self.render_overscan / page.rect.width
+            matrix = matrices[page.rect.width] = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=matrix, alpha=False)
+        # Pixel sizes below were tuned on 144 DPI renders (2 px per point);
+        # scale them so they cover the same area of the page at this zoom
+        scale = matrix.a / 2
+
+        def split_path(suffix):
             output_path = os.path.join(output_dir, f"{page_num+1:04d}{suffix}.bmp")
             # Ensure path isn't too long
             if len(output_path) > self.max_path_length:
                 output_path = output_path[:self.max_path_length-4] + ".bmp"
-            img.convert("1", dither=Image.FLOYDSTEINBERG) \
-               .transpose(Image.ROTATE_270) \
-               .save(output_path)
             return output_path
 
-        if np.array(top_split.convert("L")).min() < 240:
-            save_split(top_split, "a")
-        if np.array(bottom_split.convert("L")).min() < 240:
-            save_split(bottom_split, "b")
+        if njit is not None:
+            # Gray, autocontrast, crop, split and dither in one compiled pass
+            # samples_mv is the pixmap's own memory, so the page is never copied out of it;
+            # the gray page reuses this worker's buffer from the last page. Band rows get
+            # fresh buffers, as the writer thread may still be saving the last page's
+            samples = np.frombuffer(pix.samples_mv, np.uint8).reshape(pix.height, pix.width, pix.n)
+            size = pix.width * ((pix.height + 31) // 32) * 4  # Rows for a band as tall as the page
+            top_rows, top_width, bottom_rows, bottom_width = _render_splits(
+                samples, _scratch("gray", (pix.height, pix.width), np.uint8),
+                np.empty(size, np.uint8), np.empty(size, np.uint8), 5, 220, 50 * scale)
+            del samples  # Release the view before the pixmap is freed
+            for rows, width, suffix in ((top_rows, top_width, "a"), (bottom_rows, bottom_width, "b")):
+                if rows.size:
+                    _worker["writer"].write(split_path(suffix), _bmp1_header(width, rows.shape[0]), rows)
+            return
+
+        # pix.samples is already a bytes copy of the pixmap; wrap that copy rather than making another
+        img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", 0, 1)
+        gray = ImageOps.autocontrast(img.convert("L"), cutoff=5)
+        
+        # One array serves the edge scan, the crop and both splits as views
+        arr = self._crop_whitespace(np.asarray(gray), scale)
+        height = arr.shape[0]
+
+        top_split = arr[:int(height * 0.55)]
+        bottom_split = arr[int(height * 0.45):]
+
+        for split, suffix in ((top_split, "a"), (bottom_split, "b")):
+            if split.min() < 240:
+                # Encode in memory; the writer thread puts it on disk
+                encoded = io.BytesIO()
+                Image.fromarray(split).convert("1", dither=Image.FLOYDSTEINBERG) \
+                   .transpose(Image.ROTATE_270) \
+                   .save(encoded, "BMP")
+                _worker["writer"].write(split_path(suffix), encoded.getbuffer())
 
     def _sanitize(self, text):
         """Enhanced sanitization for Windows paths with length limits"""
-        # Remove all problematic characters
-        sanitized = re.sub(r'[\\/*?:"<>|()…]', "", text)
-        # Replace spaces with underscores
-        sanitized = sanitized.replace(" ", "_")
-        # Trim to reasonable length (leave room for path components)
-        max_length = 50  # Conservative limit for individual folder names
-        return sanitized[:max_length]
+        return _sanitize_name(text)
 
 if __name__ == "__main__":
     os.system('cls' if os.name == 'nt' else 'clear')